@@ -6,35 +6,69 @@
 import argparse
 import base64
 import hashlib
-import re
+import mmap
+import multiprocessing
 import os
+import stat
 import sys
 
 
+# Translation table mapping every non-word character to '_', the same set
+# re.sub(r'\W', '_', ...) replaces for byte strings.
+_DEFINE_NAME_TABLE = ''.join(
+    c if c.isalnum() or c == '_' else '_' for c in map(chr, range(256)))
+
+
 def ComputeIntegrity(input_path):
   hasher = hashlib.sha256()
-  with open(input_path, 'r') as f:
-    hasher.update(f.read())
-  return base64.b64encode(hasher.digest())
+  with open(input_path, 'rb') as f:
+    st = os.fstat(f.fileno())
+    if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+      # Hash the mapped file directly so it doesn't have to be copied into
+      # memory first.
+      mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        hasher.update(mm)
+      finally:
+        mm.close()
+    else:
+      # Empty files can't be mapped, and pipes or procfs-style files can't be
+      # mapped or report a size of 0, so read those in 1mb chunks instead.
+      while True:
+        chunk = f.read(1024 * 1024)
+        if not chunk:
+          break
+        hasher.update(chunk)
+  integrity = base64.b64encode(hasher.digest())
+  # b64encode() returns bytes on Python 3; keep it a native str so it can be
+  # joined with the (native str) file names.
+  if not isinstance(integrity, str):
+    integrity = integrity.decode('ascii')
+  return integrity
 
 
 def WriteHeader(input_paths_and_integrity, output_path):
-  with open(output_path, 'w') as f:
-    f.write('// DO NOT MODIFY THIS FILE DIRECTLY!\n')
-    f.write('// IT IS GENERATED BY generate_integrity_header.py\n')
-    f.write('// FROM:\n')
-    for (input_filename, _) in input_paths_and_integrity:
-      f.write('//     * ' + input_filename + '\n')
+  # Assemble the whole header first so it is emitted with a single write.
+  parts = [
+      '// DO NOT MODIFY THIS FILE DIRECTLY!\n',
+      '// IT IS GENERATED BY generate_integrity_header.py\n',
+      '// FROM:\n',
+  ]
+  for (input_filename, _) in input_paths_and_integrity:
+    parts.append('//     * %s\n' % input_filename)
 
-    f.write('\n')
+  parts.append('\n')
 
-    for (input_filename, integrity) in input_paths_and_integrity:
-      define_name = re.sub('\W', '_', input_filename.upper())
-      define_name = define_name + '_INTEGRITY'
+  for (input_filename, integrity) in input_paths_and_integrity:
+    define_name = input_filename.upper().translate(_DEFINE_NAME_TABLE)
+    define_name = define_name + '_INTEGRITY'
 
-      f.write('#define ' + define_name + ' "' + integrity + '"\n')
+    parts.append('#define %s "%s"\n\n' % (define_name, integrity))
 
-      f.write('\n')
+  # Join before opening the output so an error doesn't leave it truncated.
+  header = ''.join(parts)
+  with open(output_path, 'w') as f:
+    f.write(header)
 
 
 def main():
@@ -48,8 +82,22 @@ def main():
   input_paths = args.input_path
   output_path = args.output_path
 
-  input_paths_and_integrity = [(os.path.basename(path), ComputeIntegrity(path))
-                          for path in input_paths]
+  # Each input is hashed independently, so spread them across processes.
+  # Pool.map() preserves the input order, keeping the output deterministic.
+  if len(input_paths) > 1:
+    pool = multiprocessing.Pool(
+        min(len(input_paths), multiprocessing.cpu_count()))
+    try:
+      integrities = pool.map(ComputeIntegrity, input_paths)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    integrities = [ComputeIntegrity(path) for path in input_paths]
+
+  input_paths_and_integrity = [
+      (os.path.basename(path), integrity)
+      for path, integrity in zip(input_paths, integrities)]
   WriteHeader(input_paths_and_integrity, output_path)
 
   return 0
@@ -7,7 +7,6 @@
 """
 
 import argparse
-import cStringIO
 import fnmatch
 import os
 import re
@@ -113,6 +112,47 @@ CPP_CLASSES_EXCLUDES = ['*-members*']
 FILE_WILDCARDS = ['*_8h.html']
 
 
+def CompileWildcards(wildcards):
+  """Returns a regex matching any of the fnmatch-style |wildcards|."""
+  # fnmatch.filter() normalizes case (i.e. ignores it on Windows), so do the
+  # same.
+  flags = re.IGNORECASE if os.path.normcase('A') == 'a' else 0
+  return re.compile('|'.join('(?:%s)' % fnmatch.translate(w)
+                             for w in wildcards), flags)
+
+
+C_INTERFACE_RE = CompileWildcards(C_INTERFACE_WILDCARDS)
+C_STRUCT_RE = CompileWildcards(C_STRUCT_WILDCARDS)
+CPP_CLASSES_RE = CompileWildcards(CPP_CLASSES_WILDCARDS)
+CPP_CLASSES_EXCLUDES_RE = CompileWildcards(CPP_CLASSES_EXCLUDES)
+FILE_RE = CompileWildcards(FILE_WILDCARDS)
+
+# Trailing version number of a demangled name (e.g. the "_1_1" of
+# PPB_Audio_1_1).
+TRAILING_VERSION_RE = re.compile(r'_\d_\d$')
+
+
+def Memoize(fn):
+  """Decorates single-argument |fn| to cache its results."""
+  memory = {}
+  def impl(arg):
+    if arg not in memory:
+      memory[arg] = fn(arg)
+    return memory[arg]
+  return impl
+
+
+def Demangle(mangle):
+  """Demangles a doxygen-mangled name, e.g. p_p_b___audio -> PPB_Audio."""
+  # Doxygen mangles an uppercase letter as an underscore followed by the
+  # lowercase letter, and a literal underscore as two underscores. The name
+  # starts as if preceded by a single underscore. Swap the literal underscores
+  # for a placeholder so splitting on the rest yields the capitalized parts.
+  parts = ('_' + mangle).replace('__', '\0').split('_')
+  return ''.join(p[:1].upper() + p[1:] for p in parts).replace('\0', '_')
+
+
+@Memoize
 def GetName(filename):
   filename = os.path.splitext(filename)[0]
   out = ''
@@ -139,23 +179,10 @@ def GetName(filename):
     return filename[:-3].replace('__', '_') + '.h'
   else:
     print 'No match: ' + filename
-  cap = True
-  for c in mangle:
-    if c == '_':
-      if cap:
-        # If cap is True, we've already read one underscore. The second means
-        # that we should insert a literal underscore.
-        cap = False
-      else:
-        cap = True
-        continue
-    if cap:
-      c = c.upper()
-      cap = False
-    out += c
+  out += Demangle(mangle)
 
   # Strip trailing version number (e.g. PPB_Audio_1_1 -> PPB_Audio)
-  return re.sub(r'_\d_\d$', '', out)
+  return TRAILING_VERSION_RE.sub('', out)
 
 
 def GetPath(filepath):
@@ -164,16 +191,10 @@ def GetPath(filepath):
   raise OSError('Couldn\'t find: ' + filepath)
 
 
-def MakeReSTListFromFiles(prefix, path, matches, excludes=None):
-  dir_files = os.listdir(path)
-  good_files = []
-  for match in matches:
-    good_files.extend(fnmatch.filter(dir_files, match))
-
-  if excludes:
-    for exclude in excludes:
-      good_files = [filename for filename in good_files
-                    if not fnmatch.fnmatch(filename, exclude)]
+def MakeReSTListFromFiles(prefix, path, match_re, exclude_re=None):
+  good_files = [filename for filename in os.listdir(path)
+                if match_re.match(filename) and
+                not (exclude_re and exclude_re.match(filename))]
 
   good_files.sort()
   return '\n'.join('  * `%s <%s/%s>`__\n' % (GetName(f), prefix, f)
@@ -190,48 +211,45 @@ def MakeChannelAlt(channel):
     return '-' + channel
 
 
+def WriteFile(out_filename, contents):
+  # Write to a temporary file and move it into place, so we don't write out a
+  # partial file on error.
+  tmp_filename = out_filename + '.tmp'
+  with open(tmp_filename, 'w') as f:
+    f.write(contents)
+  if sys.platform == 'win32' and os.path.exists(out_filename):
+    # os.rename() can't replace an existing file on Windows.
+    os.remove(out_filename)
+  os.rename(tmp_filename, out_filename)
+
+
 def GenerateRootIndex(channel, version, out_filename):
   channel_title = MakeTitleCase(channel)
   channel_alt = MakeChannelAlt(channel)
 
-  # Use StringIO so we don't write out a partial file on error.
-  output = cStringIO.StringIO()
-  output.write(ROOT_FILE_CONTENTS % vars())
-
-  with open(out_filename, 'w') as f:
-    f.write(output.getvalue())
+  WriteFile(out_filename, ROOT_FILE_CONTENTS % vars())
 
 
 def GenerateCIndex(root_dir, channel, version, out_filename):
   prefix = 'pepper_%s/c' % channel
-  interfaces = MakeReSTListFromFiles(prefix, root_dir, C_INTERFACE_WILDCARDS)
-  structures = MakeReSTListFromFiles(prefix, root_dir, C_STRUCT_WILDCARDS)
-  files = MakeReSTListFromFiles(prefix, root_dir, FILE_WILDCARDS)
+  interfaces = MakeReSTListFromFiles(prefix, root_dir, C_INTERFACE_RE)
+  structures = MakeReSTListFromFiles(prefix, root_dir, C_STRUCT_RE)
+  files = MakeReSTListFromFiles(prefix, root_dir, FILE_RE)
   channel_title = MakeTitleCase(channel)
   channel_alt = MakeChannelAlt(channel)
 
-  # Use StringIO so we don't write out a partial file on error.
-  output = cStringIO.StringIO()
-  output.write(C_FILE_CONTENTS % vars())
-
-  with open(out_filename, 'w') as f:
-    f.write(output.getvalue())
+  WriteFile(out_filename, C_FILE_CONTENTS % vars())
 
 
 def GenerateCppIndex(root_dir, channel, version, out_filename):
   prefix = 'pepper_%s/cpp' % channel
-  classes = MakeReSTListFromFiles(prefix, root_dir, CPP_CLASSES_WILDCARDS,
-                                  CPP_CLASSES_EXCLUDES)
-  files = MakeReSTListFromFiles(prefix, root_dir, FILE_WILDCARDS)
+  classes = MakeReSTListFromFiles(prefix, root_dir, CPP_CLASSES_RE,
+                                  CPP_CLASSES_EXCLUDES_RE)
+  files = MakeReSTListFromFiles(prefix, root_dir, FILE_RE)
   channel_title = MakeTitleCase(channel)
   channel_alt = MakeChannelAlt(channel)
 
-  # Use StringIO so we don't write out a partial file on error.
-  output = cStringIO.StringIO()
-  output.write(CPP_FILE_CONTENTS % vars())
-
-  with open(out_filename, 'w') as f:
-    f.write(output.getvalue())
+  WriteFile(out_filename, CPP_FILE_CONTENTS % vars())
 
 
 def main(argv):
@@ -70,11 +70,14 @@ Parameters:
 """
 
 
-import codecs
+import mmap
+import multiprocessing.pool
 import optparse
 import os
+import Queue
 import re
 import sys
+import threading
 
 # Prepend the grit module from the source tree so it takes precedence over other
 # grit versions that might present in the search path.
@@ -90,29 +93,14 @@ import jinja2
 LOCALIZABLE_STRINGS = 'Localizable.strings'
 INFOPLIST_STRINGS = 'InfoPlist.strings'
 
+# Map of template path -> jinja2.Template, filled by read_jinja2_template().
+JINJA2_TEMPLATE_CACHE = {}
+
 
 class LocalizeException(Exception):
   pass
 
 
-class LocalizedStringJinja2Adapter:
-  """Class that maps ID names to localized strings in Jinja2."""
-  def __init__(self, id_map, pack):
-    self.id_map = id_map
-    self.pack = pack
-
-  def __getattr__(self, name):
-    id_value = self.id_map.get(name)
-    if not id_value:
-      raise LocalizeException('Could not find id %s in resource header' % name)
-    data = self.pack.resources.get(id_value)
-    if not data:
-      raise LocalizeException(
-            'Could not find string with id %s (%d) in data pack' %
-             (name, id_value))
-    return decode_and_escape(data)
-
-
 def get_inputs(from_dir, locales):
   """Returns the list of files that would be required to run the tool."""
   inputs = []
@@ -142,6 +130,20 @@ def format_lproj_dir(to_dir, locale):
   return os.path.join(to_dir, '%s.lproj' % locale)
 
 
+def read_data_pack(data_pack_path):
+  """Reads a data pack file.
+
+  The file is memory-mapped rather than read, so that only the resources
+  sliced out of it by the parser are copied into memory.
+  """
+  with open(data_pack_path, 'rb') as f:
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+      return data_pack.ReadDataPackFromString(mm)
+    finally:
+      mm.close()
+
+
 def read_resources_header(resources_header_path):
   """Reads and parses a grit-generated resource header file.
 
@@ -154,16 +156,14 @@ def read_resources_header(resources_header_path):
 
   { 'IDS_PRODUCT_NAME': 28531, 'IDS_CANCEL': 28542 }
   """
-  regex = re.compile(r'^#define\s+(\w+)\s+(\d+)$')
-  id_map = {}
+  # [^\S\n] is whitespace other than newlines, so that a match can't span
+  # several lines of the header. The header is scanned as bytes to avoid
+  # decoding all of it; only the matched (ASCII) names are decoded.
+  regex = re.compile(br'^#define[^\S\n]+(\w+)[^\S\n]+(\d+)$', re.MULTILINE)
   try:
-    with open(resources_header_path, 'r') as f:
-      for line in f:
-        match = regex.match(line)
-        if match:
-          id_str = match.group(1)
-          id_value = int(match.group(2))
-          id_map[id_str] = id_value
+    with open(resources_header_path, 'rb') as f:
+      id_map = {match.group(1).decode('ascii'): int(match.group(2))
+                for match in regex.finditer(f.read())}
   except:
     sys.stderr.write('Error while reading header file %s\n'
                      % resources_header_path)
@@ -178,25 +178,127 @@ def read_id_list(id_list_path):
   Names are stripped of leading and trailing spaces. Empty lines are ignored.
   """
   with open(id_list_path, 'r') as f:
-    stripped_lines = [x.strip() for x in f]
-    non_empty_lines = [x for x in stripped_lines if x]
-    return non_empty_lines
+    return [x for x in (line.strip() for line in f) if x]
 
 
 def read_jinja2_template(template_path):
-  """Reads a Jinja2 template."""
-  (template_dir, template_name) = os.path.split(template_path)
-  env = jinja2.Environment(loader = jinja2.FileSystemLoader(template_dir))
-  template = env.get_template(template_name)
+  """Reads a Jinja2 template.
+
+  Templates are cached by path, so repeated calls from the same process (e.g.
+  gyp's pymod_do_main) don't lex and parse the template again.
+  """
+  template = JINJA2_TEMPLATE_CACHE.get(template_path)
+  if template is None:
+    (template_dir, template_name) = os.path.split(template_path)
+    # Templates don't change while the tool runs, so skip checking them for
+    # changes on every render. Fail on anything the template can't resolve
+    # (e.g. an id missing from the "ids" dictionary) rather than rendering an
+    # empty string.
+    env = jinja2.Environment(loader = jinja2.FileSystemLoader(template_dir),
+                             auto_reload = False,
+                             undefined = jinja2.StrictUndefined)
+    template = env.get_template(template_name)
+    JINJA2_TEMPLATE_CACHE[template_path] = template
   return template
 
 
+def find_template_ids(template):
+  """Returns the set of ID names a Jinja2 template refers to as ids.<NAME>."""
+  env = template.environment
+  (source, _, _) = env.loader.get_source(env, template.name)
+  ast = env.parse(source)
+  return set(node.attr for node in ast.find_all(jinja2.nodes.Getattr)
+             if isinstance(node.node, jinja2.nodes.Name) and
+             node.node.name == 'ids')
+
+
 def decode_and_escape(data):
   """Decodes utf-8 data, and escapes it appropriately to use in *.strings."""
-  u_string = codecs.decode(data, 'utf-8')
-  u_string = u_string.replace('\\', '\\\\')
-  u_string = u_string.replace('"', '\\"')
-  return u_string
+  # Chained replace() calls measure much faster than a single translate()
+  # with a dict table, which does a mapping lookup per character.
+  return data.decode('utf-8').replace('\\', '\\\\').replace('"', '\\"')
+
+
+def write_files(write_queue, errors):
+  """Writes the files put on |write_queue| until None is put on it.
+
+  Items are (path, data) tuples. Stops at the first error, whose
+  sys.exc_info() is appended to |errors|.
+  """
+  while True:
+    item = write_queue.get()
+    if item is None:
+      return
+    (path, data) = item
+    try:
+      with open(path, 'wb') as f:
+        f.write(data)
+    except Exception:
+      sys.stderr.write('Error while creating %s\n' % path)
+      errors.append(sys.exc_info())
+      return
+
+
+def generate_locale(locale, from_dir, to_dir, localizable_ids,
+                    localizable_id_values, infoplist_template,
+                    infoplist_id_map, write_queue):
+  """Generates the contents of the string files for one locale.
+
+  |localizable_ids| are the IDs to write to Localizable.strings, in order, and
+  |localizable_id_values| the matching resource ID values. |infoplist_id_map|
+  maps the IDs used by |infoplist_template| to their resource ID values.
+
+  The utf-16 encoded files are put on |write_queue| as (path, data) tuples
+  rather than written directly.
+  """
+  pack = read_data_pack(os.path.join(from_dir, '%s.pak' % locale))
+
+  lproj_dir = format_lproj_dir(to_dir, locale)
+
+  # Generate Localizable.strings
+  localizable_strings_path = os.path.join(lproj_dir, LOCALIZABLE_STRINGS)
+  try:
+    resources = pack.resources
+    localized_data_list = [resources.get(id_value)
+                           for id_value in localizable_id_values]
+    lines = []
+    for id_str, id_value, localized_data in zip(
+        localizable_ids, localizable_id_values, localized_data_list):
+      if not localized_data:
+        raise LocalizeException(
+            'Could not find localized string in %s for %s (%d)' %
+            (localizable_strings_path, id_str, id_value))
+
+      lines.append(u'"%s" = "%s";\n' %
+                   (id_str, decode_and_escape(localized_data)))
+
+    write_queue.put((localizable_strings_path,
+                     u''.join(lines).encode('utf-16')))
+  except:
+    sys.stderr.write('Error while creating %s\n' % localizable_strings_path)
+    raise
+
+  # Generate InfoPlist.strings
+  infoplist_strings_path = os.path.join(lproj_dir, INFOPLIST_STRINGS)
+  try:
+    infoplist_ids = {}
+    for id_str, id_value in infoplist_id_map.items():
+      data = pack.resources.get(id_value)
+      if not data:
+        raise LocalizeException(
+            'Could not find string with id %s (%d) in data pack' %
+            (id_str, id_value))
+      infoplist_ids[id_str] = decode_and_escape(data)
+
+    try:
+      infoplist = infoplist_template.render(ids = infoplist_ids)
+    except jinja2.UndefinedError as e:
+      raise LocalizeException('Could not render %s: %s' %
+                              (infoplist_template.name, e))
+    write_queue.put((infoplist_strings_path, infoplist.encode('utf-16')))
+  except:
+    sys.stderr.write('Error while creating %s\n' % infoplist_strings_path)
+    raise
 
 
 def generate(from_dir, to_dir, localizable_list_path, infoplist_template_path,
@@ -207,47 +309,56 @@ def generate(from_dir, to_dir, localizable_list_path, infoplist_template_path,
   localizable_ids = read_id_list(localizable_list_path)
   infoplist_template = read_jinja2_template(infoplist_template_path)
 
-  # Generate string files for each locale
-  for locale in locales:
-    pack = data_pack.ReadDataPack(
-        os.path.join(os.path.join(from_dir, '%s.pak' % locale)))
+  # The IDs to localize are the same for every locale, so resolve their
+  # values once up front.
+  localizable_id_values = [id_map.get(id_str) for id_str in localizable_ids]
+  for id_str, id_value in zip(localizable_ids, localizable_id_values):
+    if not id_value:
+      raise LocalizeException('Could not find "%s" in %s' %
+                              (id_str, resources_header_path))
 
+  infoplist_id_map = {}
+  for id_str in find_template_ids(infoplist_template):
+    id_value = id_map.get(id_str)
+    if not id_value:
+      raise LocalizeException(
+          'Could not find id %s in resource header' % id_str)
+    infoplist_id_map[id_str] = id_value
+
+  for locale in locales:
     lproj_dir = format_lproj_dir(to_dir, locale)
     if not os.path.exists(lproj_dir):
       os.makedirs(lproj_dir)
 
-    # Generate Localizable.strings
-    localizable_strings_path = os.path.join(lproj_dir, LOCALIZABLE_STRINGS)
-    try:
-      with codecs.open(localizable_strings_path, 'w', 'utf-16') as f:
-        for id_str in localizable_ids:
-          id_value = id_map.get(id_str)
-          if not id_value:
-            raise LocalizeException('Could not find "%s" in %s' %
-                                    (id_str, resources_header_path))
-
-          localized_data = pack.resources.get(id_value)
-          if not localized_data:
-            raise LocalizeException(
-                'Could not find localized string in %s for %s (%d)' %
-                (localizable_strings_path, id_str, id_value))
-
-          f.write(u'"%s" = "%s";\n' %
-                  (id_str, decode_and_escape(localized_data)))
-    except:
-      sys.stderr.write('Error while creating %s\n' % localizable_strings_path)
-      raise
-
-    # Generate InfoPlist.strings
-    infoplist_strings_path = os.path.join(lproj_dir, INFOPLIST_STRINGS)
-    try:
-      with codecs.open(infoplist_strings_path, 'w', 'utf-16') as f:
-        infoplist = infoplist_template.render(
-            ids = LocalizedStringJinja2Adapter(id_map, pack))
-        f.write(infoplist)
-    except:
-      sys.stderr.write('Error while creating %s\n' % infoplist_strings_path)
-      raise
+  # Generate string files for each locale. Locales are independent, so their
+  # contents are generated on a pool of threads, while a single writer thread
+  # writes the files out as they become ready.
+  write_queue = Queue.Queue()
+  write_errors = []
+  writer = threading.Thread(target=write_files,
+                            args=(write_queue, write_errors))
+
+  def generate_one(locale):
+    generate_locale(locale, from_dir, to_dir, localizable_ids,
+                    localizable_id_values, infoplist_template, infoplist_id_map,
+                    write_queue)
+
+  # Only start the writer once the pool exists, so that it is always told to
+  # stop below and can't keep the process alive.
+  pool = multiprocessing.pool.ThreadPool(min(32, len(locales)))
+  writer.start()
+  try:
+    pool.map(generate_one, locales)
+  finally:
+    pool.close()
+    pool.join()
+    write_queue.put(None)
+    writer.join()
+
+  if write_errors:
+    # Re-raise with the writer thread's traceback.
+    (exc_type, exc_value, exc_traceback) = write_errors[0]
+    raise exc_type, exc_value, exc_traceback
 
 
 def DoMain(args):